@@ -0,0 +1,529 @@
+"""
+eCFR Fetcher Core
+Shared pieces of the eCFR data fetchers: API configuration, the title to
+agency mapping, cached title size lookups and the atomic data file write
+"""
+
+import aiohttp
+import asyncio
+import diskcache
+import ijson
+import orjson
+import os
+import tempfile
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+import logging
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+logger = logging.getLogger(__name__)
+
+# eCFR API configuration
+ECFR_BASE_URL = "https://www.ecfr.gov/api/versioner/v1"
+DATA_FILE = "data/agency_data.json"
+SIZE_CACHE_DIR = "data/.size_cache"
+STREAM_CHUNK_SIZE = 64 * 1024  # Bytes read from the socket per iteration
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60)  # Per request, per attempt
+MAX_CONCURRENT_FETCHES = 10  # Titles being fetched at once
+
+# JSON bodies compress roughly 10x, so GETs ask for gzip/deflate and the
+# body is decompressed as it streams in; sizes are always counted on the
+# decompressed bytes. HEAD asks for the identity encoding so Content-Length
+# is the uncompressed size too, matching what the streaming fallback counts.
+COMPRESSED_HEADERS = {"Accept-Encoding": "gzip, deflate"}
+IDENTITY_HEADERS = {"Accept-Encoding": "identity"}
+
+# Retry transient network failures with exponential backoff before giving up
+retry_transient = retry(
+    retry=retry_if_exception_type((asyncio.TimeoutError, aiohttp.ClientError)),
+    wait=wait_exponential(multiplier=0.5, max=10),
+    stop=stop_after_attempt(4),
+    reraise=True
+)
+
+# Title to Agency mapping: title number -> (agency name, agency code)
+# (simplified - actual mapping is more complex)
+_TITLE_AGENCY_MAP = {
+    1: ("General Provisions", "GEN"),
+    2: ("Grants and Agreements", "GRANTS"),
+    3: ("The President", "POTUS"),
+    4: ("Accounts", "GAO"),
+    5: ("Administrative Personnel", "OPM"),
+    6: ("Domestic Security", "DHS"),
+    7: ("Agriculture", "USDA"),
+    8: ("Aliens and Nationality", "USCIS"),
+    9: ("Animals and Animal Products", "APHIS"),
+    10: ("Energy", "DOE"),
+    11: ("Federal Elections", "FEC"),
+    12: ("Banks and Banking", "FRB"),
+    13: ("Business Credit and Assistance", "SBA"),
+    14: ("Aeronautics and Space", "FAA"),
+    15: ("Commerce and Foreign Trade", "DOC"),
+    16: ("Commercial Practices", "FTC"),
+    17: ("Commodity and Securities Exchanges", "SEC"),
+    18: ("Conservation of Power and Water Resources", "FERC"),
+    19: ("Customs Duties", "CBP"),
+    20: ("Employees' Benefits", "DOL"),
+    21: ("Food and Drugs", "FDA"),
+    22: ("Foreign Relations", "STATE"),
+    23: ("Highways", "FHWA"),
+    24: ("Housing and Urban Development", "HUD"),
+    25: ("Indians", "BIA"),
+    26: ("Internal Revenue", "IRS"),
+    27: ("Alcohol, Tobacco and Firearms", "ATF"),
+    28: ("Judicial Administration", "DOJ"),
+    29: ("Labor", "DOL"),
+    30: ("Mineral Resources", "DOI"),
+    31: ("Money and Finance: Treasury", "TREAS"),
+    32: ("National Defense", "DOD"),
+    33: ("Navigation and Navigable Waters", "USCG"),
+    34: ("Education", "ED"),
+    36: ("Parks, Forests, and Public Property", "NPS"),
+    37: ("Patents, Trademarks, and Copyrights", "USPTO"),
+    38: ("Pensions, Bonuses, and Veterans' Relief", "VA"),
+    39: ("Postal Service", "USPS"),
+    40: ("Protection of Environment", "EPA"),
+    41: ("Public Contracts and Property Management", "GSA"),
+    42: ("Public Health", "HHS"),
+    43: ("Public Lands: Interior", "BLM"),
+    44: ("Emergency Management and Assistance", "FEMA"),
+    45: ("Public Welfare", "HHS"),
+    46: ("Shipping", "MARAD"),
+    47: ("Telecommunication", "FCC"),
+    48: ("Federal Acquisition Regulations System", "FAR"),
+    49: ("Transportation", "DOT"),
+    50: ("Wildlife and Fisheries", "FWS"),
+}
+
+@dataclass(slots=True)
+class TitleRecord:
+    """Size information for a single CFR title"""
+    title_number: int
+    title_name: str
+    size_mb: float
+    size_bytes: int
+
+
+# On-disk cache of title sizes, opened on first use
+_size_cache = None
+
+def get_size_cache() -> diskcache.Cache:
+    """
+    Get the on-disk title size cache
+    
+    Entries are keyed by title number and hold the size, title name, the
+    eCFR date they were fetched for, and the ETag/Last-Modified validators
+    the server sent with them.
+    """
+    global _size_cache
+    
+    if _size_cache is None:
+        _size_cache = diskcache.Cache(SIZE_CACHE_DIR)
+    
+    return _size_cache
+
+def title_record(title_number: int, title_name: str, size_bytes: int) -> TitleRecord:
+    """
+    Build the size record for a title
+    
+    Args:
+        title_number: The CFR title number
+        title_name: Name of the title
+        size_bytes: Size of the title document in bytes
+        
+    Returns:
+        Title size record with the size also given in MB
+    """
+    return TitleRecord(title_number, title_name, round(size_bytes / (1024 * 1024), 2), size_bytes)
+
+def cached_title_record(title_number: int, date_str: str, title_name: Optional[str] = None,
+                        cached: Optional[Dict[str, Any]] = None) -> Optional[TitleRecord]:
+    """
+    Get the size record of a title already sized for a date from the size cache
+    
+    Every sized title is written to the size cache straight away, so this
+    also covers titles finished by an earlier run that crashed.
+    
+    Args:
+        title_number: The CFR title number
+        date_str: eCFR snapshot date (YYYY-MM-DD)
+        title_name: Title name from the /titles listing, if already known
+        cached: Size cache entry for the title, if already looked up
+        
+    Returns:
+        Title size record, or None if the title has not been sized for date_str
+    """
+    if cached is None:
+        cached = get_size_cache().get(title_number)
+    
+    if not cached or cached["date"] != date_str:
+        return None
+    
+    return title_record(title_number, title_name or cached["title_name"], cached["size_bytes"])
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Create the pooled HTTP session used for eCFR requests
+    
+    Every request goes to the same host, so a run shares one session and
+    its kept-alive connections instead of paying a TCP+TLS handshake for
+    each new session. There is deliberately no session-wide timeout: each
+    request gets its own (see REQUEST_TIMEOUT) so queued titles are not
+    failed by the clock of earlier ones. The pool is larger than the
+    worker count so a connection is always available.
+    """
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_FETCHES * 2, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector)
+
+async def fetch_title_structure(session: Optional[aiohttp.ClientSession] = None) -> List[Dict[str, Any]]:
+    """
+    Fetch the list of all CFR titles from eCFR API
+    
+    Args:
+        session: aiohttp session to reuse; a new one is created if omitted
+    
+    Returns:
+        List of title objects with metadata
+    """
+    if session is None:
+        async with create_session() as session:
+            return await fetch_title_structure(session)
+    
+    url = f"{ECFR_BASE_URL}/titles"
+    
+    try:
+        async with session.get(url, headers=COMPRESSED_HEADERS, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            if response.status != 200:
+                logger.error(f"Failed to fetch titles: HTTP {response.status}")
+                return []
+            
+            data = await response.json(loads=orjson.loads)
+            titles = data.get("titles", [])
+            logger.info(f"Fetched {len(titles)} CFR titles")
+            return titles
+    
+    except asyncio.TimeoutError:
+        logger.error("Timeout while fetching title structure")
+        return []
+    except Exception as e:
+        logger.error(f"Error fetching title structure: {e}")
+        return []
+
+@retry_transient
+async def fetch_content_length(url: str, session: aiohttp.ClientSession,
+                               cached: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Get the size of a resource from a HEAD request without downloading it
+    
+    Args:
+        url: Resource URL
+        session: aiohttp session for connection pooling
+        cached: Previous size cache entry; its validators are sent so an
+            unchanged resource is answered with 304 Not Modified
+        
+    Returns:
+        Dictionary with size_bytes, etag and last_modified, or None if the
+        server did not provide a Content-Length
+    """
+    headers = dict(IDENTITY_HEADERS)
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    
+    async with session.head(url, headers=headers, allow_redirects=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status == 304 and cached:
+            return {
+                "size_bytes": cached["size_bytes"],
+                "etag": cached.get("etag"),
+                "last_modified": cached.get("last_modified")
+            }
+        
+        if response.status != 200:
+            return None
+        
+        content_length = response.headers.get("Content-Length")
+        if content_length is None or not content_length.isdigit():
+            return None
+        
+        return {
+            "size_bytes": int(content_length),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+
+def _make_decoder(content_encoding: Optional[str]):
+    """
+    Create an incremental decompressor for a Content-Encoding header
+    
+    Args:
+        content_encoding: Content-Encoding of the response, if any
+        
+    Returns:
+        zlib decompress object, or None for an uncompressed body
+    """
+    encoding = (content_encoding or "").strip().lower()
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    return None
+
+@retry_transient
+async def stream_title_body(url: str, session: aiohttp.ClientSession, find_title: bool) -> Optional[Dict[str, Any]]:
+    """
+    Stream a title document, measuring it without keeping it in memory
+    
+    Args:
+        url: Title document URL
+        session: aiohttp session for connection pooling
+        find_title: Whether to extract the top-level "title" field
+        
+    Returns:
+        Dictionary with size_bytes, title_name, etag and last_modified, or
+        None if the document could not be fetched
+    """
+    # Take the raw (compressed) bytes off the socket and decompress them
+    # ourselves, so inflating runs in the executor with the parsing below
+    # rather than on the event loop
+    async with session.get(url, headers=COMPRESSED_HEADERS, timeout=REQUEST_TIMEOUT,
+                           auto_decompress=False) as response:
+        if response.status != 200:
+            logger.warning(f"Failed to fetch {url}: HTTP {response.status}")
+            return None
+        
+        # Count bytes as they arrive and pluck the "title" field with an
+        # incremental parser instead of decoding the whole document.
+        # Decompressing and parsing are CPU work, so they run in the default
+        # executor to keep the event loop free for the other titles' socket
+        # reads; zlib releases the GIL while inflating, so several titles
+        # decompress in parallel.
+        loop = asyncio.get_running_loop()
+        decoder = _make_decoder(response.headers.get("Content-Encoding"))
+        found = ijson.sendable_list()
+        state = {
+            "size_bytes": 0,
+            "parser": ijson.items_coro(found, "title") if find_title else None
+        }
+        
+        def consume(chunk: bytes, last: bool = False) -> None:
+            if decoder is not None:
+                chunk = decoder.flush() if last else decoder.decompress(chunk)
+            state["size_bytes"] += len(chunk)
+            
+            parser = state["parser"]
+            if parser is None:
+                return
+            # An empty send() is ijson's EOF signal and raises
+            # StopIteration, so only real data goes in and EOF is close()
+            if chunk:
+                parser.send(chunk)
+            if found:
+                # Got what we need; just count the remaining bytes
+                state["parser"] = None
+            elif last:
+                parser.close()
+        
+        # An identity body whose title is already known only needs its
+        # bytes counted, which is not worth a round trip to the executor
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            if decoder is None and state["parser"] is None:
+                state["size_bytes"] += len(chunk)
+            else:
+                await loop.run_in_executor(None, consume, chunk)
+        if decoder is not None or state["parser"] is not None:
+            await loop.run_in_executor(None, consume, b"", True)
+        
+        return {
+            "size_bytes": state["size_bytes"],
+            "title_name": found[0] if found else None,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+
+async def fetch_title_content(title_number: int, session: aiohttp.ClientSession,
+                              title_name: Optional[str] = None,
+                              date_str: Optional[str] = None) -> Optional[TitleRecord]:
+    """
+    Fetch the size and name of a specific CFR title
+    
+    Sizes already fetched for today's date are served from the size cache.
+    Otherwise the size comes from a (conditional) HEAD request when the
+    server reports a Content-Length; the body is only streamed as a fallback.
+    
+    Args:
+        title_number: The CFR title number
+        session: aiohttp session for connection pooling
+        title_name: Title name from the /titles listing, if already known
+        date_str: eCFR snapshot date (YYYY-MM-DD); defaults to today (UTC)
+        
+    Returns:
+        Title size record, or None if the title could not be fetched
+    """
+    date_str = date_str or datetime.utcnow().strftime('%Y-%m-%d')
+    url = f"{ECFR_BASE_URL}/full/{date_str}/title-{title_number}.json"
+    
+    try:
+        cache = get_size_cache()
+        cached = cache.get(title_number)
+        
+        record = cached_title_record(title_number, date_str, title_name, cached)
+        if record is not None:
+            return record
+        
+        head = await fetch_content_length(url, session, cached)
+        
+        if head is not None and (title_name or cached):
+            size_bytes = head["size_bytes"]
+            title_name = title_name or cached["title_name"]
+            etag, last_modified = head["etag"], head["last_modified"]
+        else:
+            body = await stream_title_body(url, session, find_title=title_name is None)
+            if body is None:
+                return None
+            
+            size_bytes = body["size_bytes"]
+            title_name = title_name or body["title_name"]
+            etag, last_modified = body["etag"], body["last_modified"]
+        
+        title_name = title_name or f"Title {title_number}"
+        cache.set(title_number, {
+            "date": date_str,
+            "size_bytes": size_bytes,
+            "title_name": title_name,
+            "etag": etag,
+            "last_modified": last_modified
+        })
+        
+        return title_record(title_number, title_name, size_bytes)
+    
+    except ijson.JSONError:
+        logger.error(f"Invalid JSON for title {title_number}")
+        return None
+    except asyncio.TimeoutError:
+        logger.warning(f"Timeout fetching title {title_number}")
+        return None
+    except Exception as e:
+        logger.error(f"Error fetching title {title_number}: {e}")
+        return None
+
+async def fetch_title_records(titles: List[Dict[str, Any]], session: aiohttp.ClientSession,
+                              date_str: str) -> List[Optional[TitleRecord]]:
+    """
+    Fetch the size records of all numbered titles with a bounded worker pool
+    
+    Args:
+        titles: List of title metadata objects from /titles
+        session: aiohttp session for connection pooling
+        date_str: eCFR snapshot date (YYYY-MM-DD)
+        
+    Returns:
+        One entry per numbered title, in listing order; None for titles
+        that could not be fetched
+    """
+    numbered = [title for title in titles if title.get("number")]
+    
+    # One slot per title, filled by listing index, so the results (and the
+    # data file built from them) keep the /titles order however the
+    # fetches interleave
+    results = [None] * len(numbered)
+    
+    # Queue the titles and drain them with a fixed pool of workers, so
+    # only MAX_CONCURRENT_FETCHES titles are ever in flight
+    queue = asyncio.Queue()
+    for index, title in enumerate(numbered):
+        # Titles already sized for this date (e.g. by a run that crashed)
+        # never enter the queue
+        results[index] = cached_title_record(title["number"], date_str, title.get("name"))
+        if results[index] is None:
+            queue.put_nowait(index)
+    
+    resumed = len(numbered) - queue.qsize()
+    if resumed:
+        logger.info(f"Resuming: {resumed} titles already sized for {date_str}")
+    
+    # fetch_title_content logs and returns None on failure, never raises
+    async def worker():
+        while not queue.empty():
+            index = queue.get_nowait()
+            title = numbered[index]
+            results[index] = await fetch_title_content(title["number"], session, title.get("name"), date_str)
+    
+    logger.info(f"Fetching content for {queue.qsize()} titles...")
+    await asyncio.gather(*(worker() for _ in range(MAX_CONCURRENT_FETCHES)))
+    
+    return results
+
+def atomic_write_json(data: Dict[str, Any], path: str = DATA_FILE) -> None:
+    """
+    Write data as compact JSON, atomically replacing the file at path
+    
+    The serialized bytes are written to a uniquely named temporary file
+    next to path and fsynced before it is renamed over path, and the
+    directory is fsynced after the rename, so readers only ever see a
+    complete file and the new version survives a crash once this returns.
+    Overlapping writers never share a temporary file. The temporary file
+    is removed if anything fails.
+    
+    Args:
+        data: Data to serialize; may contain dataclass records
+        path: Destination file
+    """
+    buf = memoryview(orjson.dumps(data))
+    directory = os.path.dirname(path) or "."
+    
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        try:
+            os.fchmod(fd, 0o644)
+            while buf:
+                buf = buf[os.write(fd, buf):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    
+    # The rename itself is only durable once the directory entry is flushed
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+async def write_data_file(agencies: List[Any], total_size_mb: float, start_time: datetime) -> None:
+    """
+    Assemble the agency data file and atomically replace DATA_FILE with it
+    
+    The write runs in a worker thread, so the fsync does not block the
+    event loop.
+    
+    Args:
+        agencies: Aggregated agencies, as records or dictionaries
+        total_size_mb: Total size of all titles in MB
+        start_time: When the fetch started (UTC), for the reported duration
+    """
+    end_time = datetime.utcnow()
+    
+    final_data = {
+        "agencies": agencies,
+        "total_agencies": len(agencies),
+        "total_size_mb": total_size_mb,
+        "last_sync": end_time.isoformat() + "Z",
+        "fetch_duration_seconds": (end_time - start_time).total_seconds()
+    }
+    
+    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
+    await asyncio.to_thread(atomic_write_json, final_data, DATA_FILE)
+    
+    logger.info(f"Data update completed successfully in {final_data['fetch_duration_seconds']:.2f} seconds")
+    logger.info(f"Total agencies: {len(agencies)}, Total size: {total_size_mb:.2f} MB")
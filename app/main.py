@@ -3,19 +3,30 @@ eCFR Regulations API - Main Application with Beautiful Dashboard
 FastAPI application that provides regulation size data via REST API and web dashboard
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.openapi.docs import (
+    get_redoc_html,
+    get_swagger_ui_html,
+    get_swagger_ui_oauth2_redirect_html
+)
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from contextlib import asynccontextmanager
-import json
+import asyncio
+import gzip
+import hashlib
+import orjson
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timezone
 import logging
 from pathlib import Path
 
 from .scheduler import start_scheduler, stop_scheduler, get_scheduler_status
 from .fetcher import fetch_and_update_data
+from .fetcher_core import DATA_FILE, create_session
+from .models import AgencyData, AgencyResponse, HealthResponse
 
 # Configure logging
 logging.basicConfig(
@@ -24,37 +35,63 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Data file path
-DATA_FILE = "data/agency_data.json"
+# Lifespan context managers for startup/shutdown
+@asynccontextmanager
+async def http_lifespan(app: FastAPI):
+    """Own the pooled eCFR HTTP session shared by every data update"""
+    async with create_session() as session:
+        app.state.http = session
+        try:
+            yield
+        finally:
+            app.state.http = None
 
-# Lifespan context manager for startup/shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events"""
     logger.info("Starting eCFR API application...")
     
-    # Start the background scheduler
-    start_scheduler()
+    # Start the background scheduler; each update also rebuilds the caches.
+    # It is the outermost layer, so it is stopped even if startup fails.
+    # With several workers only one of them gets the scheduler, and only
+    # that one runs the initial fetch; the others pick the file up once
+    # it is written.
+    runs_scheduler = start_scheduler(update_data_and_caches)
     
-    # Initial data check
-    if not os.path.exists(DATA_FILE):
-        logger.info("No data file found. Triggering initial data fetch...")
-        try:
-            await fetch_and_update_data()
-        except Exception as e:
-            logger.error(f"Initial data fetch failed: {e}")
-    
-    yield
-    
-    # Shutdown
-    logger.info("Shutting down eCFR API application...")
-    stop_scheduler()
+    try:
+        async with http_lifespan(app):
+            # Read the dashboard template and build the OpenAPI schema
+            # before the first request needs them
+            load_dashboard()
+            load_openapi_blob()
+            
+            # Initial data check
+            if runs_scheduler and not os.path.exists(DATA_FILE):
+                logger.info("No data file found. Triggering initial data fetch...")
+                try:
+                    await fetch_and_update_data(app.state.http)
+                except Exception as e:
+                    logger.error(f"Initial data fetch failed: {e}")
+            
+            await refresh_caches()
+            
+            yield
+    finally:
+        # Shutdown
+        logger.info("Shutting down eCFR API application...")
+        if runs_scheduler:
+            stop_scheduler()
 
 # Create FastAPI application
 app = FastAPI(
     title="eCFR Regulations API",
     description="API for accessing federal regulation sizes from eCFR.gov",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
+    # Served below from a schema serialized once
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None,
     lifespan=lifespan
 )
 
@@ -67,30 +104,220 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def load_data():
-    """Load agency data from JSON file"""
-    if not os.path.exists(DATA_FILE):
+# Timestamp string for the current second, shared by every request in it
+_now_iso = {"second": None, "value": None}
+
+def now_iso() -> str:
+    """
+    Get the current UTC time as an ISO 8601 string with second precision
+    
+    The string is formatted at most once per second rather than per call.
+    """
+    second = int(time.time())
+    
+    if _now_iso["second"] != second:
+        _now_iso["value"] = datetime.fromtimestamp(second, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        _now_iso["second"] = second
+    
+    return _now_iso["value"]
+
+# Parsed data file and the lookups derived from it, reused until the
+# fetcher replaces the file
+_data_cache = {"key": None, "entry": None}
+_data_cache_lock = threading.Lock()
+
+def build_cache_entry(data):
+    """
+    Precompute everything the endpoints derive from the agency data
+    
+    Args:
+        data: Parsed agency data file
+        
+    Returns:
+        Dictionary with the data, an index of agencies by upper-cased code,
+        the aggregate statistics served by /api/stats, and the serialized
+        response bodies for /api/agencies (plain and gzipped) and each agency
+    """
+    agencies = data.get("agencies", [])
+    
+    # Build the index and find the extremes in a single pass
+    by_code = {}
+    largest = smallest = None
+    for agency in agencies:
+        by_code.setdefault(agency["code"].upper(), agency)
+        
+        size_mb = agency["regulation_size_mb"]
+        if largest is None or size_mb > largest["regulation_size_mb"]:
+            largest = agency
+        if smallest is None or size_mb < smallest["regulation_size_mb"]:
+            smallest = agency
+    
+    stats = {
+        "total_agencies": len(agencies),
+        "total_size_mb": data.get("total_size_mb", 0),
+        "largest_agency": largest,
+        "smallest_agency": smallest,
+        "average_size_mb": round(data.get("total_size_mb", 0) / len(agencies), 2) if agencies else 0,
+        "last_sync": data.get("last_sync")
+    }
+    
+    blob = orjson.dumps(data)
+    
+    return {
+        "data": data,
+        "by_code": by_code,
+        "stats": stats,
+        "blob": blob,
+        "blob_gz": gzip.compress(blob, 6),
+        "agency_blobs": {code: orjson.dumps(agency) for code, agency in by_code.items()}
+    }
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Check whether an Accept-Encoding header allows a gzip response
+    
+    An explicit gzip entry takes precedence over the * wildcard.
+    
+    Args:
+        accept_encoding: Value of the request's Accept-Encoding header
+        
+    Returns:
+        True if gzip (or, when gzip is not listed, *) has a non-zero q-value
+    """
+    qvalues = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip()
+        if coding not in ("gzip", "*"):
+            continue
+        
+        q = 1.0
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qvalues[coding] = q
+    
+    q = qvalues.get("gzip", qvalues.get("*", 0.0))
+    return q > 0
+
+def precompressed_response(request: Request, blob: bytes, blob_gz: bytes) -> Response:
+    """
+    Build a JSON response from a body that was compressed ahead of time
+    
+    Args:
+        request: Incoming request, used for content negotiation
+        blob: Serialized JSON body
+        blob_gz: The same body, gzip-compressed
+        
+    Returns:
+        gzip-encoded response if the client accepts it, otherwise identity
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    
+    if accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=blob_gz, media_type="application/json", headers=headers)
+    
+    return Response(content=blob, media_type="application/json", headers=headers)
+
+def data_file_key():
+    """
+    Identify the current version of the data file
+    
+    The fetcher replaces the file with os.replace, which always gives it a
+    new inode, so a rewrite is noticed even when the filesystem's
+    timestamps are too coarse to change and the size happens to match.
+    
+    Returns:
+        Tuple of the file's inode, modification time and size, or None if
+        missing
+    """
+    try:
+        st = os.stat(DATA_FILE)
+    except FileNotFoundError:
         logger.error(f"Data file not found: {DATA_FILE}")
         return None
     
-    try:
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading data file: {e}")
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def load_cache_entry():
+    """
+    Load agency data from JSON file along with its precomputed lookups
+    
+    The entry is kept in memory and only rebuilt when the file is replaced
+    or its modification time or size changes.
+    
+    Returns:
+        Cache entry (see build_cache_entry), or None if no data is available
+    """
+    key = data_file_key()
+    if key is None:
         return None
+    
+    with _data_cache_lock:
+        if _data_cache["key"] == key:
+            return _data_cache["entry"]
+        
+        try:
+            # One read of the whole file, parsed straight from the bytes
+            entry = build_cache_entry(orjson.loads(Path(DATA_FILE).read_bytes()))
+        except Exception as e:
+            logger.error(f"Error loading data file: {e}")
+            return None
+        
+        # Entry before key, so a lock-free reader that sees the new key
+        # also sees the new entry
+        _data_cache["entry"] = entry
+        _data_cache["key"] = key
+        return entry
 
-# Root endpoint - Beautiful Dashboard
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    """Serve beautiful dashboard at root"""
-    dashboard_path = Path(__file__).parent / "templates" / "dashboard.html"
+async def load_cache_entry_async():
+    """
+    Load the cache entry without blocking the event loop
     
-    if dashboard_path.exists():
-        return dashboard_path.read_text()
+    A warm cache is answered straight away; reading and parsing a new
+    data file runs in a worker thread so other requests keep being served.
     
-    # Fallback simple HTML if dashboard file not found
-    return """
+    Returns:
+        Cache entry (see build_cache_entry), or None if no data is available
+    """
+    key = data_file_key()
+    if key is None:
+        return None
+    
+    if _data_cache["key"] == key:
+        return _data_cache["entry"]
+    
+    return await asyncio.to_thread(load_cache_entry)
+
+async def refresh_caches():
+    """
+    Rebuild the cached data entry from the data file on disk
+    
+    Called after every update so the parsing, indexing and serialization
+    happen in the update job instead of in the first request after it.
+    """
+    if await asyncio.to_thread(load_cache_entry) is not None:
+        logger.info("Data caches refreshed")
+
+async def update_data_and_caches():
+    """Fetch fresh data from eCFR, then rebuild the caches from it"""
+    # Reuse the application's session while it is open; outside the
+    # lifespan the fetcher opens its own
+    session = getattr(app.state, "http", None)
+    await fetch_and_update_data(session if session is not None and not session.closed else None)
+    await refresh_caches()
+
+def load_data():
+    """Load agency data from JSON file"""
+    entry = load_cache_entry()
+    return entry["data"] if entry else None
+
+# Fallback simple HTML if dashboard file not found
+FALLBACK_DASHBOARD_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -115,40 +342,115 @@ async def root():
     </html>
     """
 
-@app.get("/health")
+# Browsers may reuse the dashboard for this long before revalidating it
+DASHBOARD_MAX_AGE = 3600
+
+# Dashboard page bytes and their ETag, read once on first use
+_dashboard = None
+
+def load_dashboard():
+    """
+    Get the dashboard page, reading the template from disk only once
+    
+    Returns:
+        Dictionary with the encoded dashboard HTML (or the fallback page if
+        the template is missing) and its ETag
+    """
+    global _dashboard
+    
+    if _dashboard is None:
+        dashboard_path = Path(__file__).parent / "templates" / "dashboard.html"
+        if dashboard_path.exists():
+            html = dashboard_path.read_bytes()
+        else:
+            html = FALLBACK_DASHBOARD_HTML.encode()
+        _dashboard = {"html": html, "etag": f'"{hashlib.sha1(html).hexdigest()}"'}
+    
+    return _dashboard
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check whether an If-None-Match header matches an ETag
+    
+    Args:
+        if_none_match: Value of the request's If-None-Match header
+        etag: Current ETag of the resource
+        
+    Returns:
+        True if the client's cached copy is still current
+    """
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+# Root endpoint - Beautiful Dashboard
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    """Serve beautiful dashboard at root"""
+    dashboard = load_dashboard()
+    headers = {
+        "ETag": dashboard["etag"],
+        "Cache-Control": f"public, max-age={DASHBOARD_MAX_AGE}"
+    }
+    
+    # Returning visitors revalidate with the ETag and get an empty 304
+    if etag_matches(request.headers.get("if-none-match", ""), dashboard["etag"]):
+        return Response(status_code=304, headers=headers)
+    
+    return HTMLResponse(content=dashboard["html"], headers=headers)
+
+# Serialized /health body and the values it was built from
+_health = {"key": None, "blob": None}
+
+@app.get("/health", response_model=HealthResponse)
 async def health_check():
     """
     Health check endpoint
     Returns API status and last data update time
     """
-    data = load_data()
+    entry = await load_cache_entry_async()
+    data = entry["data"] if entry else None
     
-    return {
-        "status": "healthy" if data else "degraded",
-        "version": "1.0.0",
-        "last_data_update": data.get("last_sync") if data else None,
-        "timestamp": datetime.utcnow().isoformat() + "Z"
-    }
+    # Probes hit this many times a second; the body only changes with the
+    # data file or the timestamp's second, so it is encoded once per change
+    key = (bool(data), data.get("last_sync") if data else None, now_iso())
+    
+    if _health["key"] != key:
+        status, last_data_update, timestamp = key
+        _health["blob"] = orjson.dumps({
+            "status": "healthy" if status else "degraded",
+            "version": "1.0.0",
+            "last_data_update": last_data_update,
+            "timestamp": timestamp
+        })
+        _health["key"] = key
+    
+    return Response(content=_health["blob"], media_type="application/json")
 
-@app.get("/api/agencies")
-async def get_agencies():
+# The agency routes return pre-serialized bytes, so their response models
+# only document the schema; FastAPI does not validate or re-encode them
+@app.get("/api/agencies", response_model=AgencyResponse)
+async def get_agencies(request: Request):
     """
     Get all federal agencies with their regulation sizes
     
     Returns:
         JSON containing list of agencies with sizes and metadata
     """
-    data = load_data()
+    entry = await load_cache_entry_async()
     
-    if not data:
+    if not entry or not entry["data"]:
         raise HTTPException(
             status_code=503,
             detail="Data not available. Initial data fetch may be in progress."
         )
     
-    return data
+    # Serialized and compressed once per data file rather than per request
+    return precompressed_response(request, entry["blob"], entry["blob_gz"])
 
-@app.get("/api/agencies/{agency_code}")
+@app.get("/api/agencies/{agency_code}", response_model=AgencyData)
 async def get_agency(agency_code: str):
     """
     Get specific agency by code
@@ -159,27 +461,23 @@ async def get_agency(agency_code: str):
     Returns:
         JSON containing agency details
     """
-    data = load_data()
+    entry = await load_cache_entry_async()
     
-    if not data:
+    if not entry or not entry["data"]:
         raise HTTPException(
             status_code=503,
             detail="Data not available"
         )
     
-    # Find agency by code
-    agency = next(
-        (a for a in data.get("agencies", []) if a["code"].upper() == agency_code.upper()),
-        None
-    )
+    blob = entry["agency_blobs"].get(agency_code.upper())
     
-    if not agency:
+    if not blob:
         raise HTTPException(
             status_code=404,
             detail=f"Agency with code '{agency_code}' not found"
         )
     
-    return agency
+    return Response(content=blob, media_type="application/json")
 
 @app.get("/api/stats")
 async def get_statistics():
@@ -189,24 +487,15 @@ async def get_statistics():
     Returns:
         JSON containing aggregate statistics
     """
-    data = load_data()
+    entry = await load_cache_entry_async()
     
-    if not data:
+    if not entry or not entry["data"]:
         raise HTTPException(
             status_code=503,
             detail="Data not available"
         )
     
-    agencies = data.get("agencies", [])
-    
-    return {
-        "total_agencies": len(agencies),
-        "total_size_mb": data.get("total_size_mb", 0),
-        "largest_agency": max(agencies, key=lambda x: x["regulation_size_mb"]) if agencies else None,
-        "smallest_agency": min(agencies, key=lambda x: x["regulation_size_mb"]) if agencies else None,
-        "average_size_mb": round(data.get("total_size_mb", 0) / len(agencies), 2) if agencies else 0,
-        "last_sync": data.get("last_sync")
-    }
+    return entry["stats"]
 
 @app.post("/api/refresh")
 async def refresh_data(background_tasks: BackgroundTasks):
@@ -217,12 +506,12 @@ async def refresh_data(background_tasks: BackgroundTasks):
     Returns:
         JSON confirmation message
     """
-    background_tasks.add_task(fetch_and_update_data)
+    background_tasks.add_task(update_data_and_caches)
     
     return {
         "message": "Data refresh triggered",
         "status": "processing",
-        "timestamp": datetime.utcnow().isoformat() + "Z"
+        "timestamp": now_iso()
     }
 
 @app.get("/api/scheduler/status")
@@ -235,10 +524,57 @@ async def scheduler_status():
     """
     return get_scheduler_status()
 
+# Serialized OpenAPI schema, built on first use
+_openapi_blob = None
+
+def load_openapi_blob() -> bytes:
+    """
+    Get the OpenAPI schema as JSON bytes, generating and encoding it once
+    
+    Returns:
+        orjson-encoded OpenAPI schema
+    """
+    global _openapi_blob
+    
+    if _openapi_blob is None:
+        _openapi_blob = orjson.dumps(app.openapi())
+    
+    return _openapi_blob
+
+@app.get("/openapi.json", include_in_schema=False)
+async def openapi_schema():
+    """Serve the precomputed OpenAPI schema"""
+    return Response(content=load_openapi_blob(), media_type="application/json")
+
+# Docs pages link to the schema through the ASGI root_path, as FastAPI's
+# built-in routes do, so they keep working behind a path-prefixing proxy
+SWAGGER_UI_OAUTH2_REDIRECT_URL = "/docs/oauth2-redirect"
+
+@app.get("/docs", include_in_schema=False)
+async def swagger_ui(request: Request):
+    """Serve the Swagger UI API documentation"""
+    root_path = request.scope.get("root_path", "").rstrip("/")
+    return get_swagger_ui_html(
+        openapi_url=root_path + "/openapi.json",
+        title=f"{app.title} - Swagger UI",
+        oauth2_redirect_url=root_path + SWAGGER_UI_OAUTH2_REDIRECT_URL
+    )
+
+@app.get(SWAGGER_UI_OAUTH2_REDIRECT_URL, include_in_schema=False)
+async def swagger_ui_redirect():
+    """Serve the Swagger UI OAuth2 redirect page"""
+    return get_swagger_ui_oauth2_redirect_html()
+
+@app.get("/redoc", include_in_schema=False)
+async def redoc(request: Request):
+    """Serve the ReDoc API documentation"""
+    root_path = request.scope.get("root_path", "").rstrip("/")
+    return get_redoc_html(openapi_url=root_path + "/openapi.json", title=f"{app.title} - ReDoc")
+
 # Custom exception handlers
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=404,
         content={
             "error": "Not Found",
@@ -250,15 +586,24 @@ async def not_found_handler(request, exc):
 @app.exception_handler(500)
 async def internal_error_handler(request, exc):
     logger.error(f"Internal server error: {exc}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": "Internal Server Error",
             "message": "An unexpected error occurred",
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "timestamp": now_iso()
         }
     )
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop and httptools ship with uvicorn[standard]; multiple workers need
+    # the app as an import string. WEB_CONCURRENCY sets the worker count.
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2))
+    )
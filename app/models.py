@@ -3,7 +3,7 @@ Pydantic Models
 Data validation models for API requests and responses
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
 from datetime import datetime
 
@@ -15,8 +15,8 @@ class AgencyData(BaseModel):
     last_updated: str = Field(..., description="ISO 8601 timestamp of last update")
     titles: Optional[List[dict]] = Field(None, description="List of CFR titles for this agency")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "name": "Environmental Protection Agency",
                 "code": "EPA",
@@ -31,6 +31,7 @@ class AgencyData(BaseModel):
                 ]
             }
         }
+    )
 
 class AgencyResponse(BaseModel):
     """Model for the main agencies API response"""
@@ -39,8 +40,8 @@ class AgencyResponse(BaseModel):
     total_size_mb: float = Field(..., description="Total size of all regulations in MB", ge=0)
     last_sync: Optional[str] = Field(None, description="ISO 8601 timestamp of last data synchronization")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "agencies": [
                     {
@@ -61,6 +62,7 @@ class AgencyResponse(BaseModel):
                 "last_sync": "2025-10-28T10:30:00Z"
             }
         }
+    )
 
 class HealthResponse(BaseModel):
     """Model for health check response"""
@@ -69,8 +71,8 @@ class HealthResponse(BaseModel):
     last_data_update: Optional[str] = Field(None, description="ISO 8601 timestamp of last data update")
     timestamp: str = Field(..., description="Current timestamp")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "status": "healthy",
                 "version": "1.0.0",
@@ -78,6 +80,7 @@ class HealthResponse(BaseModel):
                 "timestamp": "2025-10-28T14:23:15Z"
             }
         }
+    )
 
 class ErrorResponse(BaseModel):
     """Model for error responses"""
@@ -86,8 +89,8 @@ class ErrorResponse(BaseModel):
     timestamp: Optional[str] = Field(None, description="Error timestamp")
     path: Optional[str] = Field(None, description="Request path that caused the error")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "error": "Not Found",
                 "message": "The requested resource was not found",
@@ -95,3 +98,4 @@ class ErrorResponse(BaseModel):
                 "path": "/api/agencies/INVALID"
             }
         }
+    )
@@ -7,37 +7,126 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime
 import logging
+import os
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; assume a single process there
+    fcntl = None
 
 from .fetcher import fetch_and_update_data
 
 logger = logging.getLogger(__name__)
 
-# Global scheduler instance
+# Held by the one process (of possibly several server workers) that runs
+# the scheduler, so the daily update is not repeated once per worker
+SCHEDULER_LOCK_FILE = "data/.scheduler.lock"
+
+# Global scheduler instance and the lock file it holds
 scheduler = None
+_lock_file = None
+
+def acquire_scheduler_lock() -> bool:
+    """
+    Try to become the process that runs the scheduler
+    
+    The lock is an exclusive, non-blocking flock on SCHEDULER_LOCK_FILE held
+    until release_scheduler_lock(); the OS drops it if the process dies.
+    
+    Returns:
+        True if this process holds the lock
+    """
+    global _lock_file
+    
+    if _lock_file is not None or fcntl is None:
+        return True
+    
+    os.makedirs(os.path.dirname(SCHEDULER_LOCK_FILE), exist_ok=True)
+    lock_file = open(SCHEDULER_LOCK_FILE, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    
+    _lock_file = lock_file
+    return True
+
+def release_scheduler_lock():
+    """
+    Release the scheduler lock if this process holds it
+    """
+    global _lock_file
+    
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
 
-def start_scheduler():
+def scheduler_lock_held_elsewhere() -> bool:
+    """
+    Check whether another process holds the scheduler lock
+    
+    Probes with a shared, non-blocking flock on a fresh open of the lock
+    file, which fails only while some process holds the exclusive lock.
+    
+    Returns:
+        True if another process runs the scheduler
+    """
+    if _lock_file is not None or fcntl is None:
+        return False
+    
+    try:
+        probe = open(SCHEDULER_LOCK_FILE, "r")
+    except FileNotFoundError:
+        return False
+    
+    with probe:
+        try:
+            fcntl.flock(probe, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(probe, fcntl.LOCK_UN)
+    return False
+
+def start_scheduler(job_func=fetch_and_update_data):
     """
     Start the background scheduler for daily data updates
     
     Schedules data fetch to run daily at 2 AM UTC
+    
+    Only one process runs the scheduler: when several server workers start,
+    the others find the scheduler lock taken and skip it.
+    
+    Args:
+        job_func: Coroutine function run for each update; defaults to
+            fetch_and_update_data
+    
+    Returns:
+        True if the scheduler runs in this process
     """
     global scheduler
     
     if scheduler is not None and scheduler.running:
         logger.warning("Scheduler already running")
-        return
+        return True
+    
+    if not acquire_scheduler_lock():
+        logger.info("Scheduler already running in another process")
+        return False
     
-    scheduler = AsyncIOScheduler()
+    scheduler = AsyncIOScheduler(timezone="UTC")
     
     # Schedule daily update at 2 AM UTC
     # This ensures data is updated within 24 hours of eCFR changes
     scheduler.add_job(
-        fetch_and_update_data,
-        trigger=CronTrigger(hour=2, minute=0),  # Daily at 2:00 AM UTC
+        job_func,
+        trigger=CronTrigger(hour=2, minute=0, timezone="UTC"),  # Daily at 2:00 AM UTC
         id='daily_data_update',
         name='Daily eCFR data update',
         replace_existing=True,
-        max_instances=1  # Prevent overlapping runs
+        max_instances=1,  # Prevent overlapping runs
+        coalesce=True,  # Run missed updates once, not once per missed day
+        misfire_grace_time=3600  # Still run if woken up to an hour late
     )
     
     # Optional: Add more frequent update for testing (every 6 hours)
@@ -54,6 +143,7 @@ def start_scheduler():
     scheduler.start()
     logger.info("Background scheduler started successfully")
     logger.info(f"Next scheduled update: {scheduler.get_job('daily_data_update').next_run_time}")
+    return True
 
 def stop_scheduler():
     """
@@ -65,6 +155,7 @@ def stop_scheduler():
         scheduler.shutdown(wait=True)
         logger.info("Background scheduler stopped")
         scheduler = None
+        release_scheduler_lock()
     else:
         logger.warning("Scheduler not running")
 
@@ -72,14 +163,19 @@ def get_scheduler_status():
     """
     Get current scheduler status and job information
     
+    With several server workers only one runs the scheduler; the others
+    report it as running in another process, without its jobs.
+    
     Returns:
         Dictionary with scheduler status
     """
     global scheduler
     
     if scheduler is None or not scheduler.running:
+        elsewhere = scheduler_lock_held_elsewhere()
         return {
-            "running": False,
+            "running": elsewhere,
+            "in_this_process": False,
             "jobs": []
         }
     
@@ -94,6 +190,7 @@ def get_scheduler_status():
     
     return {
         "running": True,
+        "in_this_process": True,
         "jobs": jobs
     }
 
@@ -4,7 +4,10 @@ Test suite for eCFR API
 
 import pytest
 from fastapi.testclient import TestClient
-from app.main import app
+from unittest.mock import AsyncMock, Mock, patch
+from datetime import datetime
+import app.main as main
+from app.main import app, load_openapi_blob, now_iso, update_data_and_caches
 import json
 import os
 
@@ -55,6 +58,17 @@ def test_root_endpoint():
     assert "version" in data
     assert "endpoints" in data
 
+def test_root_etag_not_modified():
+    """Test the dashboard is revalidated with its ETag instead of resent"""
+    response = client.get("/")
+    assert response.status_code == 200
+    assert "max-age" in response.headers["cache-control"]
+    
+    etag = response.headers["etag"]
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
 def test_get_agencies(setup_test_data):
     """Test agencies endpoint returns data correctly"""
     response = client.get("/api/agencies")
@@ -66,6 +80,25 @@ def test_get_agencies(setup_test_data):
     assert "last_sync" in data
     assert len(data["agencies"]) == 2
 
+def test_get_agencies_gzip(setup_test_data, sample_agency_data):
+    """Test agencies endpoint serves the precompressed body when gzip is accepted"""
+    response = client.get("/api/agencies", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == sample_agency_data
+    
+    response = client.get("/api/agencies", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == sample_agency_data
+
+def test_get_agencies_gzip_beats_wildcard(setup_test_data):
+    """Test an explicit gzip entry wins over a refused wildcard, and vice versa"""
+    response = client.get("/api/agencies", headers={"Accept-Encoding": "*;q=0, gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    
+    response = client.get("/api/agencies", headers={"Accept-Encoding": "gzip;q=0, *"})
+    assert "content-encoding" not in response.headers
+
 def test_get_agencies_no_data():
     """Test agencies endpoint when no data available"""
     # Remove data file if exists
@@ -75,6 +108,29 @@ def test_get_agencies_no_data():
     response = client.get("/api/agencies")
     assert response.status_code == 503
 
+def test_get_agencies_reloads_changed_file(setup_test_data, sample_agency_data):
+    """Test that a rewritten data file is picked up instead of the cached copy"""
+    assert len(client.get("/api/agencies").json()["agencies"]) == 2
+    
+    sample_agency_data["agencies"].pop()
+    with open("data/agency_data.json", "w") as f:
+        json.dump(sample_agency_data, f)
+    
+    assert len(client.get("/api/agencies").json()["agencies"]) == 1
+
+def test_get_agencies_reloads_replaced_file_same_stat(setup_test_data, sample_agency_data):
+    """Test that a replaced file is reloaded even if mtime and size are unchanged"""
+    assert client.get("/api/agencies").json()["agencies"][0]["code"] == "EPA"
+    
+    st = os.stat("data/agency_data.json")
+    sample_agency_data["agencies"][0]["code"] = "EPB"
+    with open("data/agency_data.new.json", "w") as f:
+        json.dump(sample_agency_data, f)
+    os.utime("data/agency_data.new.json", ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace("data/agency_data.new.json", "data/agency_data.json")
+    
+    assert client.get("/api/agencies").json()["agencies"][0]["code"] == "EPB"
+
 def test_get_agency_by_code(setup_test_data):
     """Test getting specific agency by code"""
     response = client.get("/api/agencies/EPA")
@@ -114,6 +170,63 @@ def test_health_endpoint_no_data():
     # Should still return 200 but with degraded status
     assert response.status_code in [200, 503]
 
+def test_health_endpoint_reuses_blob(setup_test_data, sample_agency_data):
+    """Test that /health is encoded once per second and data change"""
+    clock = Mock(time=Mock(return_value=1761647400.25))
+    with patch('app.main.time', clock):
+        client.get("/health")
+        blob = main._health["blob"]
+        
+        clock.time.return_value = 1761647400.75
+        response = client.get("/health")
+        assert main._health["blob"] is blob
+        assert response.json()["timestamp"] == "2025-10-28T10:30:00Z"
+        
+        # A new sync is picked up within the same second
+        sample_agency_data["last_sync"] = "2025-10-29T02:00:00.5Z"
+        with open("data/agency_data.json", "w") as f:
+            json.dump(sample_agency_data, f)
+        response = client.get("/health")
+        assert main._health["blob"] is not blob
+        assert response.json()["last_data_update"] == "2025-10-29T02:00:00.5Z"
+        
+        blob = main._health["blob"]
+        clock.time.return_value = 1761647401.0
+        response = client.get("/health")
+        assert main._health["blob"] is not blob
+        assert response.json()["timestamp"] == "2025-10-28T10:30:01Z"
+
+def test_now_iso_formats_once_per_second():
+    """Test that now_iso() only formats when the second changes"""
+    clock = Mock(time=Mock(return_value=1761647400.1))
+    with patch('app.main.time', clock), \
+         patch('app.main.datetime', wraps=datetime) as mock_datetime:
+        assert now_iso() == "2025-10-28T10:30:00Z"
+        clock.time.return_value = 1761647400.9
+        assert now_iso() == "2025-10-28T10:30:00Z"
+        assert mock_datetime.fromtimestamp.call_count == 1
+        
+        clock.time.return_value = 1761647401.0
+        assert now_iso() == "2025-10-28T10:30:01Z"
+        assert mock_datetime.fromtimestamp.call_count == 2
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("closed", [False, True])
+async def test_update_data_and_caches_session(closed):
+    """Test that updates reuse the app's session only while it is open"""
+    session = Mock(closed=closed)
+    previous = getattr(app.state, "http", None)
+    app.state.http = session
+    try:
+        with patch('app.main.fetch_and_update_data', new_callable=AsyncMock) as mock_fetch, \
+             patch('app.main.refresh_caches', new_callable=AsyncMock) as mock_refresh:
+            await update_data_and_caches()
+    finally:
+        app.state.http = previous
+    
+    mock_fetch.assert_awaited_once_with(None if closed else session)
+    mock_refresh.assert_awaited_once()
+
 def test_stats_endpoint(setup_test_data):
     """Test statistics endpoint"""
     response = client.get("/api/stats")
@@ -174,3 +287,30 @@ def test_api_documentation():
     data = response.json()
     assert "openapi" in data
     assert "paths" in data
+    
+    response = client.get("/redoc")
+    assert response.status_code == 200
+    assert "redoc" in response.text
+    
+    response = client.get("/docs/oauth2-redirect")
+    assert response.status_code == 200
+
+def test_openapi_schema_serves_cached_blob():
+    """Test that /openapi.json serves the bytes encoded once at startup"""
+    response = client.get("/openapi.json")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == load_openapi_blob()
+
+def test_api_documentation_behind_root_path():
+    """Test that the docs pages find the schema under the proxy prefix"""
+    proxied = TestClient(app, root_path="/proxy")
+    
+    response = proxied.get("/docs")
+    assert response.status_code == 200
+    assert "/proxy/openapi.json" in response.text
+    assert "/proxy/docs/oauth2-redirect" in response.text
+    
+    response = proxied.get("/redoc")
+    assert response.status_code == 200
+    assert "/proxy/openapi.json" in response.text
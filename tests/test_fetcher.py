@@ -4,13 +4,44 @@ Tests for eCFR data fetcher
 
 import pytest
 import asyncio
-from unittest.mock import Mock, patch, AsyncMock
+import aiohttp
+import diskcache
+import gzip
+from unittest.mock import Mock, MagicMock, patch, AsyncMock
 from app.fetcher import (
-    fetch_title_structure,
-    fetch_title_content,
+    fetch_all_title_contents,
     map_titles_to_agencies,
     fetch_and_update_data
 )
+from app.fetcher_core import (
+    fetch_title_structure,
+    fetch_content_length,
+    fetch_title_content,
+    stream_title_body,
+    atomic_write_json,
+    TitleRecord
+)
+
+def mock_streaming_response(body: bytes, status: int = 200, chunk_size: int = 1024, headers=None):
+    """Build a mock aiohttp response whose body is streamed in chunks"""
+    async def iter_chunked(n):
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i + chunk_size]
+    
+    mock_response = AsyncMock()
+    mock_response.status = status
+    mock_response.headers = headers or {}
+    mock_response.content = Mock()
+    mock_response.content.iter_chunked = iter_chunked
+    return mock_response
+
+@pytest.fixture(autouse=True)
+def size_cache(tmp_path):
+    """Point the title size cache at a fresh temporary directory"""
+    cache = diskcache.Cache(str(tmp_path / "size_cache"))
+    with patch('app.fetcher_core._size_cache', cache):
+        yield cache
+    cache.close()
 
 @pytest.mark.asyncio
 async def test_fetch_title_structure():
@@ -46,85 +77,312 @@ async def test_fetch_title_structure_error():
 @pytest.mark.asyncio
 async def test_fetch_title_content():
     """Test fetching content for a specific title"""
-    with patch('aiohttp.ClientSession') as mock_session:
-        # Mock successful response with content
-        mock_response = AsyncMock()
-        mock_response.status = 200
-        mock_response.read = AsyncMock(return_value=b'{"title": "Test Title"}' * 1000)
-        
-        session = AsyncMock()
-        session.get.return_value.__aenter__.return_value = mock_response
-        
-        result = await fetch_title_content(40, session)
-        assert result is not None
-        assert "title_number" in result
-        assert "size_mb" in result
-        assert result["title_number"] == 40
+    body = b'{"title": "Test Title", "content": "' + b"x" * 100000 + b'"}'
+    mock_response = mock_streaming_response(body)
+    
+    session = MagicMock()
+    session.get.return_value.__aenter__.return_value = mock_response
+    
+    result = await fetch_title_content(40, session)
+    assert result is not None
+    assert result.title_number == 40
+    assert result.title_name == "Test Title"
+    assert result.size_bytes == len(body)
+
+@pytest.mark.asyncio
+async def test_fetch_title_content_gzip():
+    """Test that a gzip-encoded title is measured on its decompressed size"""
+    body = b'{"title": "Test Title", "content": "' + b"x" * 100000 + b'"}'
+    mock_response = mock_streaming_response(gzip.compress(body), headers={"Content-Encoding": "gzip"})
+    
+    session = MagicMock()
+    session.get.return_value.__aenter__.return_value = mock_response
+    
+    result = await fetch_title_content(40, session)
+    assert result.title_name == "Test Title"
+    assert result.size_bytes == len(body)
+    assert session.get.call_args.kwargs["auto_decompress"] is False
+
+@pytest.mark.asyncio
+async def test_fetch_title_content_without_title_field():
+    """Test that a document with no "title" falls back to the title number"""
+    body = b'{"content": "' + b"x" * 100000 + b'"}'
+    
+    session = MagicMock()
+    session.get.return_value.__aenter__.return_value = mock_streaming_response(body)
+    
+    result = await asyncio.wait_for(fetch_title_content(40, session), timeout=5)
+    assert result.title_name == "Title 40"
+    assert result.size_bytes == len(body)
+
+@pytest.mark.asyncio
+async def test_fetch_title_content_gzip_without_title_field():
+    """Test that a gzip document with no "title" falls back to the title number"""
+    body = b'{"content": "' + b"x" * 100000 + b'"}'
+    mock_response = mock_streaming_response(gzip.compress(body), headers={"Content-Encoding": "gzip"})
+    
+    session = MagicMock()
+    session.get.return_value.__aenter__.return_value = mock_response
+    
+    result = await asyncio.wait_for(fetch_title_content(40, session), timeout=5)
+    assert result.title_name == "Title 40"
+    assert result.size_bytes == len(body)
+
+@pytest.mark.asyncio
+async def test_stream_title_body_counts_identity_inline():
+    """Test that a plain body with nothing to parse never goes to the executor"""
+    body = b'{"title": "Test Title", "content": "' + b"x" * 100000 + b'"}'
+    
+    session = MagicMock()
+    session.get.return_value.__aenter__.return_value = mock_streaming_response(body)
+    
+    loop = asyncio.get_running_loop()
+    with patch.object(loop, 'run_in_executor', wraps=loop.run_in_executor) as mock_executor:
+        result = await stream_title_body("https://example.test/title-40.json", session, find_title=False)
+    
+    assert result["size_bytes"] == len(body)
+    mock_executor.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_fetch_title_content_uses_head_size():
+    """Test that Content-Length from a HEAD request avoids downloading the title"""
+    head_response = AsyncMock()
+    head_response.status = 200
+    head_response.headers = {"Content-Length": str(2 * 1024 * 1024)}
+    
+    session = MagicMock()
+    session.head.return_value.__aenter__.return_value = head_response
+    
+    result = await fetch_title_content(40, session, "Protection of Environment")
+    assert result.title_name == "Protection of Environment"
+    assert result.size_mb == 2.0
+    assert result.size_bytes == 2 * 1024 * 1024
+    assert session.head.call_args.kwargs["headers"]["Accept-Encoding"] == "identity"
+    session.get.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_fetch_title_content_cached(size_cache):
+    """Test that a title already sized for today skips the network"""
+    head_response = AsyncMock()
+    head_response.status = 200
+    head_response.headers = {"Content-Length": "1048576", "ETag": '"abc"'}
+    
+    session = MagicMock()
+    session.head.return_value.__aenter__.return_value = head_response
+    
+    first = await fetch_title_content(40, session, "Protection of Environment")
+    session.head.reset_mock()
+    second = await fetch_title_content(40, session, "Protection of Environment")
+    
+    assert second == first
+    assert size_cache.get(40)["etag"] == '"abc"'
+    session.head.assert_not_called()
+    session.get.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_fetch_content_length_retries_transient_errors():
+    """Test that a dropped connection is retried instead of failing the title"""
+    head_response = AsyncMock()
+    head_response.status = 200
+    head_response.headers = {"Content-Length": "1024"}
+    request = MagicMock()
+    request.__aenter__.return_value = head_response
+    
+    session = MagicMock()
+    session.head.side_effect = [aiohttp.ClientConnectionError(), request]
+    
+    result = await fetch_content_length("https://example.test/title-1.json", session)
+    assert result["size_bytes"] == 1024
+    assert session.head.call_count == 2
+
+@pytest.mark.asyncio
+async def test_fetch_title_content_invalid_json():
+    """Test that a malformed title document is skipped"""
+    session = MagicMock()
+    session.get.return_value.__aenter__.return_value = mock_streaming_response(b'{"content": [1, 2')
+    
+    result = await fetch_title_content(40, session)
+    assert result is None
+
+@pytest.mark.asyncio
+async def test_fetch_all_title_contents():
+    """Test that every title is fetched and failed titles are dropped"""
+    async def fake_fetch(title_number, session, title_name=None, date_str=None):
+        if title_number == 3:
+            return None
+        return TitleRecord(title_number, title_name, 1.0, 1)
+    
+    titles = [{"number": n, "name": f"Title {n}"} for n in range(1, 26)] + [{"name": "Reserved"}]
+    
+    with patch('app.fetcher_core.fetch_title_content', side_effect=fake_fetch) as mock_fetch:
+        contents = await fetch_all_title_contents(titles)
+    
+    assert mock_fetch.call_count == 25
+    assert [c.title_number for c in contents] == [n for n in range(1, 26) if n != 3]
+
+@pytest.mark.asyncio
+async def test_fetch_all_title_contents_keeps_listing_order():
+    """Test that results follow the /titles order, not completion order"""
+    async def fake_fetch(title_number, session, title_name=None, date_str=None):
+        # Earlier titles finish last
+        await asyncio.sleep(0.001 * (30 - title_number))
+        return TitleRecord(title_number, title_name, 1.0, 1)
+    
+    titles = [{"number": n, "name": f"Title {n}"} for n in range(1, 26)]
+    
+    with patch('app.fetcher_core.fetch_title_content', side_effect=fake_fetch):
+        contents = await fetch_all_title_contents(titles)
+    
+    assert [c.title_number for c in contents] == list(range(1, 26))
+
+@pytest.mark.asyncio
+async def test_fetch_all_title_contents_resumes_from_cache(size_cache):
+    """Test that titles already sized for the date are not fetched again"""
+    size_cache.set(1, {"date": "2024-01-01", "size_bytes": 2 * 1024 * 1024,
+                       "title_name": "General Provisions", "etag": None, "last_modified": None})
+    size_cache.set(2, {"date": "2023-12-31", "size_bytes": 1024,
+                       "title_name": "Title 2", "etag": None, "last_modified": None})
+    
+    async def fake_fetch(title_number, session, title_name=None, date_str=None):
+        return TitleRecord(title_number, title_name, 1.0, 1)
+    
+    titles = [{"number": 1, "name": "General Provisions"}, {"number": 2, "name": "Title 2"}]
+    
+    with patch('app.fetcher_core.fetch_title_content', side_effect=fake_fetch) as mock_fetch:
+        contents = await fetch_all_title_contents(titles, "2024-01-01")
+    
+    assert mock_fetch.call_count == 1
+    assert mock_fetch.call_args.args[0] == 2
+    assert sorted((c.title_number, c.size_mb) for c in contents) == [(1, 2.0), (2, 1.0)]
 
 def test_map_titles_to_agencies():
     """Test mapping titles to agencies"""
     title_contents = [
-        {
-            "title_number": 40,
-            "title_name": "Protection of Environment",
-            "size_mb": 45.2
-        },
-        {
-            "title_number": 32,
-            "title_name": "National Defense",
-            "size_mb": 123.5
-        }
+        TitleRecord(40, "Protection of Environment", 45.2, 47395635),
+        TitleRecord(32, "National Defense", 123.5, 129499136)
     ]
     
-    agencies = map_titles_to_agencies(title_contents)
+    agencies, total_size_mb = map_titles_to_agencies(title_contents)
     
     assert len(agencies) > 0
-    assert all("name" in a for a in agencies)
-    assert all("code" in a for a in agencies)
-    assert all("regulation_size_mb" in a for a in agencies)
+    assert total_size_mb == 168.7
+    assert all(a.name for a in agencies)
+    assert all(a.code for a in agencies)
+    assert all(a.regulation_size_mb > 0 for a in agencies)
 
 def test_map_titles_to_agencies_aggregation():
     """Test that multiple titles for same agency are aggregated"""
     title_contents = [
-        {"title_number": 40, "title_name": "Environment", "size_mb": 20.0},
-        {"title_number": 40, "title_name": "Environment Part 2", "size_mb": 25.0}
+        TitleRecord(40, "Environment", 20.0, 20971520),
+        TitleRecord(40, "Environment Part 2", 25.0, 26214400)
     ]
     
-    agencies = map_titles_to_agencies(title_contents)
+    agencies, total_size_mb = map_titles_to_agencies(title_contents)
     
     # Should aggregate both titles into one agency
-    epa_agencies = [a for a in agencies if a["code"] == "EPA"]
+    epa_agencies = [a for a in agencies if a.code == "EPA"]
     if epa_agencies:
-        assert epa_agencies[0]["regulation_size_mb"] >= 20.0
+        assert epa_agencies[0].regulation_size_mb >= 20.0
+    assert total_size_mb == 45.0
+
+@pytest.mark.asyncio
+async def test_calculate_agency_sizes():
+    """Test sizing agencies when a title fails and the listing has gaps"""
+    from app.fetcher_fixed import calculate_agency_sizes
+    
+    sizes = {7: 1.5, 40: 2.25}
+    
+    async def fake_fetch(title_number, session, title_name=None, date_str=None):
+        if title_number == 3:
+            return None
+        return TitleRecord(title_number, title_name, sizes[title_number], 1)
+    
+    titles = [
+        {"number": 3, "name": "The President"},
+        {"name": "Reserved"},
+        {"number": 7, "name": "Agriculture"},
+        {"number": 40, "name": "Protection of Environment"}
+    ]
+    
+    with patch('app.fetcher_core.fetch_title_content', side_effect=fake_fetch):
+        agencies, total_size_mb = await calculate_agency_sizes(
+            [], titles, MagicMock(), "2024-01-01", "2024-01-01T02:00:00Z")
+    
+    by_title = {a["titles"][0]["title_number"]: a for a in agencies}
+    assert set(by_title) == {3, 7, 40}
+    
+    # A failed title still shows up under its agency, with no size
+    assert by_title[3]["code"] == "THE_PRESID"
+    assert by_title[3]["regulation_size_mb"] == 0.0
+    assert by_title[7]["titles"] == [{"title_number": 7, "size_mb": 1.5}]
+    assert by_title[40]["titles"] == [{"title_number": 40, "size_mb": 2.25}]
+    
+    assert [a["code"] for a in agencies] == ["PROTECTION", "AGRICULTUR", "THE_PRESID"]
+    assert all(a["last_updated"] == "2024-01-01T02:00:00Z" for a in agencies)
+    assert total_size_mb == 3.75
+
+def test_atomic_write_json(tmp_path):
+    """Test that the data file is replaced in one step with compact JSON"""
+    import json
+    import os
+    
+    (tmp_path / "data").mkdir()
+    path = tmp_path / "data" / "agency_data.json"
+    path.write_text('{"old": true}')
+    
+    with patch('os.fsync', wraps=os.fsync) as mock_fsync:
+        atomic_write_json({"agencies": [], "total_agencies": 0}, str(path))
+    
+    assert json.loads(path.read_text()) == {"agencies": [], "total_agencies": 0}
+    assert b"\n" not in path.read_bytes()
+    assert list(path.parent.iterdir()) == [path]
+    # Once for the file, once for the directory holding the rename
+    assert mock_fsync.call_count == 2
+
+def test_atomic_write_json_failure_keeps_old_file(tmp_path):
+    """Test that a failed write leaves the old file and no temp file behind"""
+    (tmp_path / "data").mkdir()
+    path = tmp_path / "data" / "agency_data.json"
+    path.write_text('{"old": true}')
+    
+    with pytest.raises(TypeError):
+        atomic_write_json({"agencies": object()}, str(path))
+    
+    with patch('os.replace', side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            atomic_write_json({"agencies": []}, str(path))
+    
+    assert path.read_text() == '{"old": true}'
+    assert list(path.parent.iterdir()) == [path]
 
 @pytest.mark.asyncio
-async def test_fetch_and_update_data_creates_file():
+async def test_fetch_and_update_data_creates_file(tmp_path):
     """Test that fetch_and_update_data creates data file"""
     import os
     import json
     
-    # Ensure data directory exists
-    os.makedirs("data", exist_ok=True)
+    data_file = str(tmp_path / "data" / "agency_data.json")
     
     with patch('app.fetcher.fetch_title_structure') as mock_titles, \
-         patch('app.fetcher.fetch_all_title_contents') as mock_contents:
+         patch('app.fetcher.fetch_all_title_contents') as mock_contents, \
+         patch('app.fetcher_core.DATA_FILE', data_file):
         
         # Mock data
         mock_titles.return_value = [{"number": 40, "name": "Test"}]
-        mock_contents.return_value = [
-            {"title_number": 40, "title_name": "Test", "size_mb": 10.0}
-        ]
+        mock_contents.return_value = [TitleRecord(40, "Test", 10.0, 10485760)]
         
         await fetch_and_update_data()
         
         # Check if file was created
-        assert os.path.exists("data/agency_data.json")
+        assert os.path.exists(data_file)
         
         # Verify content
-        with open("data/agency_data.json", "r") as f:
+        with open(data_file, "r") as f:
             data = json.load(f)
             assert "agencies" in data
             assert "last_sync" in data
+            assert data["agencies"][0]["code"] == "EPA"
+            assert data["agencies"][0]["titles"][0]["title_number"] == 40
 
 @pytest.mark.asyncio
 async def test_fetch_and_update_data_handles_errors():
@@ -138,16 +396,13 @@ async def test_fetch_and_update_data_handles_errors():
 
 def test_agency_data_structure():
     """Test that agency data has required fields"""
-    title_contents = [
-        {"title_number": 40, "title_name": "Test", "size_mb": 10.0}
-    ]
+    title_contents = [TitleRecord(40, "Test", 10.0, 10485760)]
     
-    agencies = map_titles_to_agencies(title_contents)
+    agencies, _ = map_titles_to_agencies(title_contents)
     
     for agency in agencies:
-        assert "name" in agency
-        assert "code" in agency
-        assert "regulation_size_mb" in agency
-        assert "last_updated" in agency
-        assert isinstance(agency["regulation_size_mb"], (int, float))
-        assert agency["regulation_size_mb"] >= 0
+        assert agency.name
+        assert agency.code
+        assert agency.last_updated
+        assert isinstance(agency.regulation_size_mb, (int, float))
+        assert agency.regulation_size_mb >= 0
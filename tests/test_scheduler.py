@@ -0,0 +1,83 @@
+"""
+Tests for the background scheduler
+"""
+
+import pytest
+import fcntl
+from unittest.mock import patch
+import app.scheduler as scheduler_module
+from app.scheduler import (
+    acquire_scheduler_lock,
+    release_scheduler_lock,
+    start_scheduler,
+    stop_scheduler,
+    get_scheduler_status
+)
+
+@pytest.fixture
+def lock_path(tmp_path):
+    """Point the scheduler lock at a temporary file"""
+    path = tmp_path / "data" / ".scheduler.lock"
+    with patch('app.scheduler.SCHEDULER_LOCK_FILE', str(path)):
+        yield path
+    release_scheduler_lock()
+
+def test_acquire_scheduler_lock_excludes_other_holders(lock_path):
+    """Test that a second open of the lock file cannot take it while held"""
+    assert acquire_scheduler_lock() is True
+    
+    with open(lock_path, "a") as other:
+        with pytest.raises(OSError):
+            fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    
+    release_scheduler_lock()
+    with open(lock_path, "a") as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+def test_acquire_scheduler_lock_fails_when_held_elsewhere(lock_path):
+    """Test that a worker finding the lock taken does not run the scheduler"""
+    lock_path.parent.mkdir(parents=True)
+    with open(lock_path, "a") as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        
+        assert acquire_scheduler_lock() is False
+        assert scheduler_module._lock_file is None
+        
+        status = get_scheduler_status()
+        assert status["running"] is True
+        assert status["in_this_process"] is False
+    
+    assert get_scheduler_status()["running"] is False
+
+def test_get_scheduler_status_without_lock_file(lock_path):
+    """Test that no scheduler is reported before any process took the lock"""
+    status = get_scheduler_status()
+    assert status["running"] is False
+    assert status["jobs"] == []
+    assert not lock_path.exists()
+
+@pytest.mark.asyncio
+async def test_start_scheduler_daily_job(lock_path):
+    """Test that the daily update runs at 2 AM UTC and catches up once"""
+    async def update():
+        pass
+    
+    assert start_scheduler(update) is True
+    try:
+        job = scheduler_module.scheduler.get_job("daily_data_update")
+        assert job.coalesce is True
+        assert job.misfire_grace_time == 3600
+        assert job.max_instances == 1
+        assert str(job.trigger.timezone) == "UTC"
+        assert job.next_run_time.utcoffset().total_seconds() == 0
+        assert (job.next_run_time.hour, job.next_run_time.minute) == (2, 0)
+        
+        status = get_scheduler_status()
+        assert status["running"] is True
+        assert status["in_this_process"] is True
+        assert [j["id"] for j in status["jobs"]] == ["daily_data_update"]
+    finally:
+        stop_scheduler()
+    
+    assert scheduler_module.scheduler is None
+    assert scheduler_module._lock_file is None